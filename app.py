@@ -1,16 +1,30 @@
 from __future__ import annotations
 
-from flask import Flask, request, jsonify, send_file, send_from_directory, Response
+from flask import Flask, request, send_from_directory, Response
 from flask_cors import CORS
+from flask_compress import Compress
+import brotli
+import orjson
 from werkzeug.exceptions import HTTPException
-from io import BytesIO
 from pathlib import Path
 from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import gzip
+import hashlib
+import mimetypes
+import multiprocessing
 import secrets
+import signal
+import tempfile
+import threading
 import time
 import os
+import re
+import zlib
 
-from timetabling import run_scheduler  # unchanged, external dependency
+from timetabling import run_scheduler  # takes workbook bytes or a binary file object
 
 # ----------------------------
 # Config
@@ -21,42 +35,205 @@ class Config:
     MAX_CONTENT_LENGTH = 25 * 1024 * 1024
     # Enable/disable debug via env var if you want
     DEBUG = os.environ.get("FLASK_DEBUG", "0") == "1"
+    # Response compression (Flask-Compress) for API JSON only; static assets
+    # ship precompressed and must keep their own ETags; tiny bodies aren't worth it
+    COMPRESS_MIMETYPES = ["application/json"]
+    COMPRESS_MIN_SIZE = 512
+    # Upper bound (seconds) on one scheduler run before the request gives up
+    SCHEDULER_TIMEOUT = 60
 
 
 # ----------------------------
 # Simple in-memory store
 # ----------------------------
-# Maps token -> (bytes, created_at)
-SCHEDULE_STORE: Dict[str, Tuple[bytes, float]] = {}
+# Maps token -> (bytes, created_at, etag), oldest first
+SCHEDULE_STORE: "OrderedDict[str, Tuple[bytes, float, str]]" = OrderedDict()
+SCHEDULE_STORE_MAX = 1024
+
+# How long generated schedules (and cached results) are kept
+STORE_TTL_SECONDS = 12 * 3600
+
+# Maps upload content hash -> (scheduler result, created_at), least recently used first
+RESULT_CACHE: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+RESULT_CACHE_MAX = 64
+
+# Scheduler runs are CPU-bound pure Python; run them in worker processes so
+# they neither hold the GIL nor block other requests on this worker
+SCHEDULER_WORKERS = os.cpu_count() or 1
+
+
+def _new_executor() -> ProcessPoolExecutor:
+    # Workers start lazily on a request thread; forking a multi-threaded server
+    # can deadlock, so start them from a clean forkserver (spawn where unavailable)
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=SCHEDULER_WORKERS,
+                               mp_context=multiprocessing.get_context(method))
+
+
+EXECUTOR = _new_executor()
+_EXECUTOR_LOCK = threading.Lock()
+# One slot per worker: a request only submits once a worker is free, so jobs never
+# wait inside the pool and a timeout always means the job itself overran
+_WORKER_SLOTS = threading.BoundedSemaphore(SCHEDULER_WORKERS)
+
+
+class SchedulerTimeout(Exception):
+    """Raised inside a worker when a scheduler run exceeds its time budget."""
+
+
+def _run_scheduler_file(path: str, timeout: float) -> Dict[str, Any]:
+    """Pool entry point: open the saved upload inside the worker and schedule it.
+
+    Where SIGALRM exists the run is interrupted after `timeout` seconds, so a
+    slow solve gives its worker back instead of holding it until it finishes.
+    """
+    def _expire(signum, frame):
+        raise SchedulerTimeout()
+
+    use_alarm = hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _expire)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with open(path, "rb") as f:
+            return run_scheduler(f)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _replace_executor(old: ProcessPoolExecutor) -> None:
+    """Swap in a fresh pool for `old` (unless another request already did) and retire it.
+
+    Jobs already queued on `old` still run; its workers exit once they are done.
+    """
+    global EXECUTOR
+    with _EXECUTOR_LOCK:
+        if EXECUTOR is old:
+            EXECUTOR = _new_executor()
+    old.shutdown(wait=False)
 
 # Directory for static frontend assets (same as before)
 FRONTEND_DIR = Path(__file__).resolve().parent / "frontend"
 
 
+def _crc_etag(body: bytes) -> str:
+    return f"{zlib.crc32(body):08x}"
+
+
+def _versioned_index(directory: Path) -> Optional[bytes]:
+    """index.html with a content-hash ?v= appended to its local .css/.js URLs.
+
+    The hash changes whenever the asset does, so those URLs can be cached as immutable.
+    """
+    index_path = directory / "index.html"
+    if not index_path.is_file():
+        return None
+    html = index_path.read_text(encoding="utf-8")
+
+    def _add_version(match: "re.Match[str]") -> str:
+        attr, name = match.group(1), match.group(2)
+        asset = directory / name
+        if not asset.is_file():
+            return match.group(0)
+        return f'{attr}="{name}?v={_crc_etag(asset.read_bytes())}"'
+
+    html = re.sub(r'\b(src|href)="([\w.-]+\.(?:css|js))"', _add_version, html)
+    return html.encode("utf-8")
+
+
+def _precompress_assets(directory: Path) -> Dict[str, Dict[str, Tuple[bytes, str]]]:
+    """Compress every .css/.js asset once: file name -> encoding -> (body, etag)."""
+    variants: Dict[str, Dict[str, Tuple[bytes, str]]] = {}
+    if not directory.is_dir():
+        return variants
+    for path in directory.iterdir():
+        if path.suffix in (".css", ".js") and path.is_file():
+            raw = path.read_bytes()
+            variants[path.name] = {}
+            for encoding, body in (("br", brotli.compress(raw, quality=11)),
+                                   ("gzip", gzip.compress(raw, compresslevel=9, mtime=0))):
+                variants[path.name][encoding] = (body, _crc_etag(body))
+    return variants
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
     app.config.from_object(Config)
     CORS(app)
+    Compress(app)
+
+    # Static assets are compressed once at startup instead of on every request
+    precompressed = _precompress_assets(FRONTEND_DIR)
+    index_html = _versioned_index(FRONTEND_DIR)
 
     # ----------------------------
     # Helpers
     # ----------------------------
 
     def _cache_static(resp: Response) -> Response:
-        # 1 day cache for static assets if they exist
+        # 1 day cache for static assets if they exist; a version query
+        # (e.g. script.js?v=<hash>) pins the content, so cache it for a year
         resp.cache_control.public = True
-        resp.cache_control.max_age = 86400
+        resp.cache_control.no_cache = None  # send_file's default would defeat max_age
+        if request.args.get("v"):
+            resp.cache_control.max_age = 31536000
+            resp.cache_control.immutable = True
+        else:
+            resp.cache_control.max_age = 86400
         return resp
 
+    def _send_asset(name: str) -> Response:
+        # Serve the best precompressed variant the client accepts, else the plain file
+        # (the plain file gets its ETag and 304 handling from send_from_directory)
+        for encoding in ("br", "gzip"):
+            variant = precompressed.get(name, {}).get(encoding)
+            if variant is not None and request.accept_encodings[encoding]:
+                body, etag = variant
+                resp = Response(body, mimetype=mimetypes.guess_type(name)[0])
+                resp.headers["Content-Encoding"] = encoding
+                resp.vary.add("Accept-Encoding")
+                resp.set_etag(etag)
+                return _cache_static(resp.make_conditional(request))
+        return _cache_static(send_from_directory(FRONTEND_DIR, name))
+
+    def _json(obj: Any, status: int = 200) -> Response:
+        # orjson is several times faster than jsonify for the preview payload
+        return Response(
+            orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY),
+            status=status,
+            mimetype="application/json",
+        )
+
     def _json_error(message: str, status: int = 400) -> Tuple[Response, int]:
-        return jsonify({"error": message}), status
+        return _json({"error": message}), status
 
-    # Basic store cleanup: remove very old items (e.g., > 12h)
+    # Basic store cleanup: remove very old items (e.g., > 12h).
+    # Entries are kept in insertion order, so expired ones are always at the front.
     def _gc_store(now: Optional[float] = None) -> None:
-        cutoff = (now or time.time()) - 12 * 3600
-        expired = [k for k, (_, ts) in SCHEDULE_STORE.items() if ts < cutoff]
-        for k in expired:
-            SCHEDULE_STORE.pop(k, None)
+        cutoff = (now or time.time()) - STORE_TTL_SECONDS
+        while SCHEDULE_STORE:
+            try:
+                # Key and value in one step: another request thread may pop it meanwhile
+                oldest, (_, ts, _) = next(iter(SCHEDULE_STORE.items()))
+            except (StopIteration, RuntimeError):
+                break  # emptied or resized under us; the next call picks up the rest
+            if ts >= cutoff and len(SCHEDULE_STORE) <= SCHEDULE_STORE_MAX:
+                break
+            SCHEDULE_STORE.pop(oldest, None)
+
+    # Identical uploads reuse the previous result instead of re-running the scheduler
+    def _cached_result(key: str) -> Optional[Dict[str, Any]]:
+        entry = RESULT_CACHE.pop(key, None)
+        if entry is None or entry[1] < time.time() - STORE_TTL_SECONDS:
+            return None
+        RESULT_CACHE[key] = entry  # re-insert as most recently used
+        return entry[0]
+
+    def _cache_result(key: str, result: Dict[str, Any]) -> None:
+        RESULT_CACHE[key] = (result, time.time())
+        while len(RESULT_CACHE) > RESULT_CACHE_MAX:
+            RESULT_CACHE.popitem(last=False)
 
     # ----------------------------
     # Error Handlers
@@ -78,24 +255,25 @@ def create_app() -> Flask:
 
     @app.route("/")
     def index():
-        index_path = FRONTEND_DIR / "index.html"
-        if index_path.exists():
-            resp = send_from_directory(FRONTEND_DIR, "index.html")
-            return resp  # no cache for HTML
-        return jsonify({"message": "Backend running. Frontend not found."}), 200
+        if index_html is not None:
+            # Asset URLs carry their content hash (see _versioned_index)
+            resp = Response(index_html, mimetype="text/html")
+            resp.cache_control.no_store = True  # no cache for HTML
+            return resp
+        return _json({"message": "Backend running. Frontend not found."}), 200
 
     @app.route("/styles.css")
     def styles():
         path = FRONTEND_DIR / "styles.css"
         if path.exists():
-            return _cache_static(send_from_directory(FRONTEND_DIR, "styles.css"))
+            return _send_asset("styles.css")
         return ("", 404)
 
     @app.route("/script.js")
     def script():
         path = FRONTEND_DIR / "script.js"
         if path.exists():
-            return _cache_static(send_from_directory(FRONTEND_DIR, "script.js"))
+            return _send_asset("script.js")
         return ("", 404)
 
     # ----------------------------
@@ -105,7 +283,7 @@ def create_app() -> Flask:
     @app.route("/api/health", methods=["GET"])
     def health():
         # Same response as before
-        return jsonify({"status": "ok"})
+        return _json({"status": "ok"})
 
     @app.route("/api/schedule", methods=["POST"])
     def schedule():
@@ -116,20 +294,65 @@ def create_app() -> Flask:
             return _json_error("No file uploaded (field name: file)", 400)
 
         file = request.files["file"]
+        # Copy the upload stream chunk-wise to a temp file, hashing it on the way
+        # to key the result cache. Workers open the file by path, so the workbook
+        # bytes are never held in (or pickled from) this process.
+        stream = file.stream
+        digest = hashlib.blake2b(digest_size=16)
+        size = 0
+        fd, upload_path = tempfile.mkstemp(suffix=".xlsx")
         try:
-            data = file.read()
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in iter(lambda: stream.read(64 * 1024), b""):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
         except Exception:
+            os.unlink(upload_path)
             return _json_error("Failed to read uploaded file", 400)
 
-        if not data:
-            return _json_error("Uploaded file is empty", 400)
-
-        # Call the original scheduler exactly as before
         try:
-            result: Dict[str, Any] = run_scheduler(data)
-        except Exception as e:
-            # Keep behavior: return the error string from scheduler
-            return _json_error(str(e), 400)
+            if not size:
+                return _json_error("Uploaded file is empty", 400)
+
+            cache_key = digest.hexdigest()
+            result = _cached_result(cache_key)
+            if result is None:
+                # Call the original scheduler in the process pool
+                timeout = app.config["SCHEDULER_TIMEOUT"]
+                if not _WORKER_SLOTS.acquire(timeout=timeout):
+                    # Every worker is busy; waiting longer would only pile up requests
+                    return _json_error("Scheduler is busy; please retry", 503)
+                executor = EXECUTOR
+                try:
+                    future = executor.submit(_run_scheduler_file, upload_path, timeout)
+                    # The worker enforces `timeout` itself; the extra seconds cover
+                    # process start-up and returning the result
+                    result = future.result(timeout=timeout + 5)
+                except SchedulerTimeout:
+                    return _json_error("Scheduling timed out", 504)
+                except FutureTimeoutError:
+                    if future.cancel():
+                        # Never started after all: the pool is healthy, just busy
+                        return _json_error("Scheduler is busy; please retry", 503)
+                    # The job is running past its SIGALRM budget: stuck in native code,
+                    # or this platform has no SIGALRM. cancel() can't stop it, so route
+                    # new uploads to a fresh pool instead of queueing them behind it.
+                    _replace_executor(executor)
+                    return _json_error("Scheduling timed out", 504)
+                except BrokenProcessPool:
+                    # A worker died (OOM kill, native crash); the pool is unusable from
+                    # now on, so replace it rather than failing every later upload
+                    _replace_executor(executor)
+                    return _json_error("Scheduler worker crashed; please retry", 503)
+                except Exception as e:
+                    # Keep behavior: return the error string from scheduler
+                    return _json_error(str(e), 400)
+                finally:
+                    # A stuck job's slot is given up too: it runs on the retired pool
+                    _WORKER_SLOTS.release()
+        finally:
+            os.unlink(upload_path)
 
         # Generate a short, URL-safe token
         token = secrets.token_hex(8)
@@ -138,10 +361,13 @@ def create_app() -> Flask:
             return _json_error("Scheduler produced no output", 400)
 
         # Store in memory
-        SCHEDULE_STORE[token] = (bytes(output_bytes), time.time())
+        output_bytes = bytes(output_bytes)
+        SCHEDULE_STORE[token] = (output_bytes, time.time(), _crc_etag(output_bytes))
+        _gc_store()
+        _cache_result(cache_key, result)
 
         # Return the same JSON contract as before
-        return jsonify({
+        return _json({
             "token": token,
             "soft_score": result.get("soft_score"),
             "counts": result.get("counts"),
@@ -154,17 +380,17 @@ def create_app() -> Flask:
         if blob is None:
             return _json_error("Invalid or expired token", 404)
 
-        buf, _created_at = blob
-        return send_file(
-            BytesIO(buf),
-            as_attachment=True,
-            download_name="schedule_output.xlsx",
+        buf, _created_at, etag = blob
+        # Respond straight from the stored bytes rather than wrapping them in a new buffer
+        resp = Response(
+            buf,
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            max_age=0,  # force fresh download
-            etag=False,
-            conditional=False,
-            last_modified=None,
+            headers={"Content-Disposition": "attachment; filename=schedule_output.xlsx"},
         )
+        resp.cache_control.no_cache = True
+        resp.cache_control.max_age = 0  # revalidate every time; unchanged blobs come back as 304
+        resp.set_etag(etag)
+        return resp.make_conditional(request, accept_ranges=True, complete_length=len(buf))
 
     return app
 
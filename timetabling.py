@@ -1,11 +1,14 @@
 from io import BytesIO
-from datetime import time, timedelta, datetime
+from datetime import time
 from collections import defaultdict
+from array import array
+from bisect import bisect_left, bisect_right
 import itertools
 import json
 import math
 import pandas as pd
-from typing import List, Dict, Any, Optional
+import xlsxwriter
+from typing import List, Dict, Any, Optional, Tuple, Union, BinaryIO
 
 
 # ----------------------------
@@ -38,16 +41,57 @@ def parse_list(value) -> List[str]:
     return [x.strip() for x in s.split(",") if x.strip()]
 
 
+def _as_text(values: pd.Series) -> pd.Series:
+    """Stripped string view of a column with missing cells as ''."""
+    return values.astype(object).where(values.notna(), "").astype(str).str.strip()
+
+
+def parse_time_series(values: pd.Series) -> pd.Series:
+    """Vectorized parse_time for a whole column; blank or unparseable cells become None."""
+    text = _as_text(values)
+    parsed = pd.to_datetime(text, format="%H:%M", errors="coerce")
+    for fmt in ("%H:%M:%S", "mixed"):
+        todo = parsed.isna() & (text != "")
+        if not todo.any():
+            break
+        parsed[todo] = pd.to_datetime(text[todo], format=fmt, errors="coerce")
+    return parsed.dt.time.astype(object).where(parsed.notna(), None)
+
+
+def parse_list_series(values: pd.Series) -> pd.Series:
+    """Vectorized parse_list for a whole column."""
+    text = _as_text(values)
+    out = text.str.split(r"\s*,\s*", regex=True).map(lambda xs: [x for x in xs if x])
+
+    # Only JSON-looking cells pay for json.loads; they keep the comma fallback on failure
+    looks_json = (
+        (text.str.startswith("[") & text.str.endswith("]"))
+        | (text.str.startswith("{") & text.str.endswith("}"))
+    )
+    for idx in text.index[looks_json]:
+        try:
+            parsed = json.loads(text[idx])
+        except Exception:
+            continue
+        if isinstance(parsed, list):
+            out[idx] = parsed
+    return out
+
+
 def t(h: int, m: int = 0) -> time:
     return time(hour=h, minute=m)
 
 
 def minutes_between(a: time, b: time) -> int:
-    return (datetime.combine(datetime.min, b) - datetime.combine(datetime.min, a)).seconds // 60
+    return (b.hour - a.hour) * 60 + (b.minute - a.minute)
 
 
-def overlap(a_start: time, a_end: time, b_start: time, b_end: time) -> bool:
-    return max(a_start, b_start) < min(a_end, b_end)
+def time_to_minutes(x: time) -> int:
+    return x.hour * 60 + x.minute
+
+
+def minutes_to_time(m: int) -> time:
+    return time(hour=m // 60, minute=m % 60)
 
 
 def time_to_str(x: time) -> str:
@@ -61,12 +105,12 @@ def time_to_str(x: time) -> str:
 def build_timeslots(days: List[str], start: time, end: time, block_min: int) -> pd.DataFrame:
     """Generate timeslot blocks per day."""
     slots = []
-    current = start
-    while minutes_between(current, end) >= block_min:
-        next_t = (datetime.combine(datetime.min, current) + timedelta(minutes=block_min)).time()
+    cur_min, end_min = time_to_minutes(start), time_to_minutes(end)
+    while end_min - cur_min >= block_min:
+        current, next_t = minutes_to_time(cur_min), minutes_to_time(cur_min + block_min)
         label = f"{time_to_str(current)}-{time_to_str(next_t)}"
         slots.append((current, next_t, label))
-        current = next_t
+        cur_min += block_min
 
     all_slots = []
     slot_id = 1
@@ -80,33 +124,54 @@ def build_timeslots(days: List[str], start: time, end: time, block_min: int) ->
 def expand_course_sessions(courses_df: pd.DataFrame) -> pd.DataFrame:
     """Expand each course into individual weekly sessions."""
     records = []
-    for _, row in courses_df.iterrows():
-        for k in range(int(row["sessions_per_week"])):
-            records.append((row["course_id"], k + 1, int(row["session_duration_min"]), row["instructor_id"]))
+    cols = ["course_id", "sessions_per_week", "session_duration_min", "instructor_id"]
+    for cid, per_week, dur, instr in courses_df[cols].itertuples(index=False, name=None):
+        for k in range(int(per_week)):
+            records.append((cid, k + 1, int(dur), instr))
     return pd.DataFrame(records, columns=["course_id", "session_index", "duration_min", "instructor_id"])
 
 
+def slots_by_day(timeslots_df: pd.DataFrame) -> Dict[Any, List[Tuple[str, int, int]]]:
+    """Group timeslots into per-day (slot_id, start_min, end_min) lists.
+
+    Expects build_timeslots output: uniform blocks, consecutive and already
+    ordered by start within each day. Days come back sorted, as groupby did.
+    """
+    by_day: Dict[Any, List[Tuple[str, int, int]]] = defaultdict(list)
+    for slot_id, day, s, e in zip(timeslots_df["slot_id"], timeslots_df["day"],
+                                  timeslots_df["start"], timeslots_df["end"]):
+        by_day[day].append((slot_id, time_to_minutes(s), time_to_minutes(e)))
+    return {day: by_day[day] for day in sorted(by_day)}
+
+
+def duration_chains(day_slots: Dict[Any, List[Tuple[str, int, int]]], block_min: int,
+                    duration_min: int) -> List[Tuple[Any, int, int, Tuple[str, ...]]]:
+    """Slide a window over each day's slots: (day, start_min, end_min, slot_ids) per chain."""
+    blocks_needed = math.ceil(duration_min / block_min)
+    return [
+        (day, slots[i][1], slots[i + blocks_needed - 1][2],
+         tuple(slot_id for slot_id, _, _ in slots[i:i + blocks_needed]))
+        for day, slots in day_slots.items()
+        for i in range(len(slots) - blocks_needed + 1)
+    ]
+
+
 def slots_matching_duration(timeslots_df: pd.DataFrame, duration_min: int) -> pd.DataFrame:
     """Return all consecutive timeslot chains matching the given duration."""
+    if timeslots_df.empty:
+        return pd.DataFrame()
     block = int(timeslots_df["duration_min"].iloc[0])
-    blocks_needed = math.ceil(duration_min / block)
     results = []
-    for day, grp in timeslots_df.groupby("day"):
-        ordered = grp.sort_values("start")
-        records = ordered.to_dict("records")
-        for i in range(len(records) - blocks_needed + 1):
-            ok = all(records[i + j]["end"] == records[i + j + 1]["start"] for j in range(blocks_needed - 1))
-            if ok:
-                start = records[i]["start"]
-                end = records[i + blocks_needed - 1]["end"]
-                results.append({
-                    "day": day,
-                    "slot_ids": [records[i + x]["slot_id"] for x in range(blocks_needed)],
-                    "start": start,
-                    "end": end,
-                    "label": f"{day} {time_to_str(start)}-{time_to_str(end)}",
-                    "duration_min": blocks_needed * block,
-                })
+    for day, s_min, e_min, slot_ids in duration_chains(slots_by_day(timeslots_df), block, duration_min):
+        start, end = minutes_to_time(s_min), minutes_to_time(e_min)
+        results.append({
+            "day": day,
+            "slot_ids": list(slot_ids),
+            "start": start,
+            "end": end,
+            "label": f"{day} {time_to_str(start)}-{time_to_str(end)}",
+            "duration_min": e_min - s_min,
+        })
     return pd.DataFrame(results)
 
 
@@ -114,9 +179,17 @@ def slots_matching_duration(timeslots_df: pd.DataFrame, duration_min: int) -> pd
 # Main scheduling pipeline
 # ----------------------------
 
-def run_scheduler(input_xlsx_bytes: bytes) -> Dict[str, Any]:
-    """Core scheduling function — same API, cleaner structure."""
-    xl = pd.ExcelFile(BytesIO(input_xlsx_bytes))
+def run_scheduler(input_xlsx: Union[bytes, BinaryIO]) -> Dict[str, Any]:
+    """Core scheduling function — same API, cleaner structure.
+
+    Accepts either the raw workbook bytes or a seekable binary file-like object
+    (e.g. an upload stream), which is read in place without an extra copy.
+    """
+    if isinstance(input_xlsx, (bytes, bytearray, memoryview)):
+        input_xlsx = BytesIO(input_xlsx)
+
+    # calamine (Rust) parses the workbook once, far faster than openpyxl
+    xl = pd.ExcelFile(input_xlsx, engine="calamine")
 
     # Read sheets
     sheets = {
@@ -138,7 +211,7 @@ def run_scheduler(input_xlsx_bytes: bytes) -> Dict[str, Any]:
     # Settings
     settings = {
         str(k).strip(): str(v).strip()
-        for k, v in settings_kv[["key", "value"]].itertuples(index=False)
+        for k, v in settings_kv[["key", "value"]].itertuples(index=False, name=None)
     }
 
     DAYS = [d.strip() for d in settings.get("DAYS", "Sat,Sun,Mon,Tue,Wed,Thu").split(",")]
@@ -147,20 +220,24 @@ def run_scheduler(input_xlsx_bytes: bytes) -> Dict[str, Any]:
     BLOCK_MIN = int(float(settings.get("BLOCK_MIN", 90)))
 
     # Normalize course/instructor columns
-    courses["equipment_required"] = courses.get("equipment_required", "").apply(parse_list)
-    instructors["preferred_days"] = instructors.get("preferred_days", "").apply(parse_list)
-    instructors["preferred_start"] = instructors.get("preferred_start", START_DAY).apply(parse_time)
-    instructors["preferred_end"] = instructors.get("preferred_end", END_DAY).apply(parse_time)
+    courses["equipment_required"] = parse_list_series(courses.get("equipment_required", ""))
+    instructors["preferred_days"] = parse_list_series(instructors.get("preferred_days", ""))
+    instructors["preferred_start"] = parse_time_series(instructors.get("preferred_start", START_DAY))
+    instructors["preferred_end"] = parse_time_series(instructors.get("preferred_end", END_DAY))
 
-    availability["available_start"] = availability["available_start"].apply(parse_time)
-    availability["available_end"] = availability["available_end"].apply(parse_time)
-    rooms["equipment"] = rooms["equipment"].apply(parse_list)
+    availability["available_start"] = parse_time_series(availability["available_start"])
+    availability["available_end"] = parse_time_series(availability["available_end"])
+    rooms["equipment"] = parse_list_series(rooms["equipment"])
+
+    # Equipment checks are subset tests on loop-invariant sets, so build them once
+    courses["_req_set"] = courses["equipment_required"].map(frozenset)
+    rooms["_eq_set"] = rooms["equipment"].map(frozenset)
 
     # Building travel times
     if not building_travel.empty:
         building_travel_min = {
             (str(f), str(t)): int(m)
-            for f, t, m in building_travel[["from", "to", "minutes"]].itertuples(index=False)
+            for f, t, m in building_travel[["from", "to", "minutes"]].itertuples(index=False, name=None)
         }
     else:
         uniq_b = sorted(rooms["building"].dropna().astype(str).unique())
@@ -169,87 +246,140 @@ def run_scheduler(input_xlsx_bytes: bytes) -> Dict[str, Any]:
     # ----------------------------
     # Scheduling logic (greedy)
     # ----------------------------
-    def instructor_available(instr_id, day, start, end):
-        av = availability[(availability.instructor_id == instr_id) & (availability.day == day)]
-        return any(r.available_start <= start and r.available_end >= end for _, r in av.iterrows())
-
-    def room_ok(room_row, required: List[str]) -> bool:
-        return set(required).issubset(set(room_row.equipment))
+    # (instructor, day) -> availability windows in minutes, sorted by start
+    avail_idx: Dict[Any, List[tuple]] = defaultdict(list)
+    for instr_id, day, a_start, a_end in zip(availability.instructor_id, availability.day,
+                                             availability.available_start, availability.available_end):
+        if a_start is not None and a_end is not None:
+            avail_idx[(instr_id, day)].append((time_to_minutes(a_start), time_to_minutes(a_end)))
+    for windows in avail_idx.values():
+        windows.sort()
+    avail_starts = {k: [a for a, _ in w] for k, w in avail_idx.items()}
+
+    def instructor_available(instr_id, day, s, e):
+        windows = avail_idx.get((instr_id, day))
+        if not windows:
+            return False
+        # Only windows opening at or before s can contain [s, e)
+        i = bisect_right(avail_starts[(instr_id, day)], s)
+        return any(a_end >= e for _, a_end in windows[:i])
 
     timeslots = build_timeslots(DAYS, START_DAY, END_DAY, BLOCK_MIN)
     sessions = expand_course_sessions(courses)
 
     # --- core greedy loop ---
     assigned = []
-    room_busy, instr_busy, student_busy = defaultdict(list), defaultdict(list), defaultdict(list)
+    # Busy intervals per (entity, day): parallel start/end minute arrays sorted by start.
+    # Intervals never overlap, so ends are sorted too and only one neighbour needs checking.
+    def new_busy():
+        return array("H"), array("H")
 
-    def free_in(intervals, s, e):
-        return not any(overlap(s, e, a, b) for (a, b) in intervals)
+    room_busy, instr_busy, student_busy = defaultdict(new_busy), defaultdict(new_busy), defaultdict(new_busy)
 
-    chains_cache: Dict[int, pd.DataFrame] = {}
+    def free_in(busy, s, e):
+        starts, ends = busy
+        i = bisect_left(starts, e) - 1
+        return i < 0 or ends[i] <= s
+
+    def mark_busy(busy, s, e):
+        starts, ends = busy
+        i = bisect_left(starts, s)
+        starts.insert(i, s)
+        ends.insert(i, e)
+
+    # duration -> [(day, start_min, end_min, slot_ids), ...]
+    chains_cache: Dict[int, List[tuple]] = {}
+
+    day_slots = slots_by_day(timeslots)
 
     def chains_for(dur):
         if dur not in chains_cache:
-            df = slots_matching_duration(timeslots, dur)
-            chains_cache[dur] = df if not df.empty else pd.DataFrame(columns=["day", "slot_ids", "start", "end"])
+            chains_cache[dur] = duration_chains(day_slots, BLOCK_MIN, dur)
         return chains_cache[dur]
 
-    course_students = enrollments.groupby("course_id")["student_id"].apply(list).to_dict()
+    # The chain score only depends on the instructor's preferences, so each
+    # (instructor, duration) pair is ranked once and reused across sessions
+    day_start_min, day_end_min = time_to_minutes(START_DAY), time_to_minutes(END_DAY)
+    chain_order_cache: Dict[tuple, List[tuple]] = {}
 
-    for _, sess in sessions.iterrows():
-        cid, instr, dur = sess.course_id, sess.instructor_id, int(sess.duration_min)
-        req = courses.loc[courses.course_id == cid, "equipment_required"].iloc[0]
-        chains = chains_for(dur)
-        placed = False
+    def ranked_chains(instr, dur):
+        key = (instr, dur)
+        if key not in chain_order_cache:
+            pref_days, ps, pe = instr_info[instr]
+            ps_min, pe_min = time_to_minutes(ps), time_to_minutes(pe)
 
-        instr_row = instructors[instructors.instructor_id == instr].iloc[0]
-        pref_days = set(instr_row.preferred_days)
-        ps, pe = instr_row.preferred_start or START_DAY, instr_row.preferred_end or END_DAY
-
-        if not chains.empty:
             def score(ch):
+                day, s_min, e_min, _ = ch
                 sc = 0
-                if ch.day in pref_days:
+                if day in pref_days:
                     sc += 2
-                if ch.start >= ps and ch.end <= pe:
+                if s_min >= ps_min and e_min <= pe_min:
                     sc += 1
-                sc -= 0.001 * (minutes_between(START_DAY, ch.start) + minutes_between(ch.end, END_DAY))
+                sc -= 0.001 * ((s_min - day_start_min) + (day_end_min - e_min))
                 return sc
 
-            chains["__score"] = chains.apply(score, axis=1)
-            chains = chains.sort_values("__score", ascending=False)
+            chain_order_cache[key] = sorted(chains_for(dur), key=score, reverse=True)
+        return chain_order_cache[key]
+
+    course_students = {c: tuple(grp) for c, grp in enrollments.groupby("course_id")["student_id"]}
+
+    # Plain dict/tuple views of the hot tables so the loop never touches pandas rows
+    course_req = dict(zip(courses.course_id, courses._req_set))
+    instr_info = {
+        i: (set(days), ps or START_DAY, pe or END_DAY)
+        for i, days, ps, pe in zip(instructors.instructor_id, instructors.preferred_days,
+                                   instructors.preferred_start, instructors.preferred_end)
+    }
+    # Smallest rooms first, so first-fit also wastes the least capacity
+    by_capacity = rooms.sort_values("capacity", kind="stable")
+    rooms_arr = list(zip(by_capacity.room_id, by_capacity.building, by_capacity.capacity,
+                         by_capacity._eq_set))
+
+    # course -> (room_id, building) of every room with the equipment and seats it needs,
+    # smallest first; the loop then only has to check whether one is free.
+    # `not capacity < n` (rather than `>=`) keeps rooms with a blank capacity usable.
+    eligible_rooms = {
+        c: [(room_id, building) for room_id, building, capacity, equipment in rooms_arr
+            if req <= equipment and not capacity < len(course_students.get(c, ()))]
+        for c, req in course_req.items()
+    }
 
-        for _, ch in chains.iterrows():
-            day, start, end = ch.day, ch.start, ch.end
-            if not instructor_available(instr, day, start, end):
+    for cid, sess_index, dur, instr in zip(sessions.course_id, sessions.session_index,
+                                           sessions.duration_min, sessions.instructor_id):
+        dur = int(dur)
+        placed = False
+        enrolled = course_students.get(cid, ())
+        candidate_rooms = eligible_rooms[cid]
+        # No room can ever host this course, so there is no chain worth trying
+        chains = ranked_chains(instr, dur) if candidate_rooms else []
+
+        for day, s_min, e_min, slot_ids in chains:
+            if not (instructor_available(instr, day, s_min, e_min)
+                    and free_in(instr_busy[(instr, day)], s_min, e_min)):
                 continue
-            for _, room in rooms.iterrows():
-                if not room_ok(room, req):
-                    continue
-                n_enrolled = len(course_students.get(cid, []))
-                if room.capacity < n_enrolled:
-                    continue
-                if not (free_in(room_busy[(room.room_id, day)], start, end)
-                        and free_in(instr_busy[(instr, day)], start, end)
-                        and all(free_in(student_busy[(sid, day)], start, end)
-                                for sid in course_students.get(cid, []))):
+            for room_id, building in candidate_rooms:
+                if not free_in(room_busy[(room_id, day)], s_min, e_min):
                     continue
+                # Students don't depend on the room and are the most lookups,
+                # so they're checked once, only after a free room turned up
+                if not all(free_in(student_busy[(sid, day)], s_min, e_min) for sid in enrolled):
+                    break
 
                 assigned.append({
                     "course_id": cid,
-                    "session_index": int(sess.session_index),
+                    "session_index": int(sess_index),
                     "instructor_id": instr,
-                    "room_id": room.room_id,
-                    "building": room.building,
+                    "room_id": room_id,
+                    "building": building,
                     "day": day,
-                    "start": start,
-                    "end": end,
-                    "slot_ids": ",".join(ch.slot_ids),
+                    "start": minutes_to_time(s_min),
+                    "end": minutes_to_time(e_min),
+                    "slot_ids": ",".join(slot_ids),
                 })
-                room_busy[(room.room_id, day)].append((start, end))
-                instr_busy[(instr, day)].append((start, end))
-                for sid in course_students.get(cid, []):
-                    student_busy[(sid, day)].append((start, end))
+                mark_busy(room_busy[(room_id, day)], s_min, e_min)
+                mark_busy(instr_busy[(instr, day)], s_min, e_min)
+                for sid in enrolled:
+                    mark_busy(student_busy[(sid, day)], s_min, e_min)
                 placed = True
                 break
             if placed:
@@ -257,7 +387,7 @@ def run_scheduler(input_xlsx_bytes: bytes) -> Dict[str, Any]:
         if not placed:
             assigned.append({
                 "course_id": cid,
-                "session_index": int(sess.session_index),
+                "session_index": int(sess_index),
                 "instructor_id": instr,
                 "room_id": None,
                 "building": None,
@@ -284,9 +414,26 @@ def run_scheduler(input_xlsx_bytes: bytes) -> Dict[str, Any]:
 
     schedule_xls = stringify_times(schedule)
 
+    # xlsxwriter's constant_memory mode flushes each row as soon as the next one
+    # starts. That needs strict row order, which to_excel (column-wise) breaks,
+    # so rows are written directly. Text goes through write_string so values that
+    # look like URLs or "{=...}" formulas stay plain text, as openpyxl wrote them.
     out_buf = BytesIO()
-    with pd.ExcelWriter(out_buf, engine="openpyxl") as writer:
-        schedule_xls.to_excel(writer, index=False, sheet_name="schedule")
+    wb = xlsxwriter.Workbook(out_buf, {"constant_memory": True, "strings_to_urls": False})
+    ws = wb.add_worksheet("schedule")
+
+    def write_cells(r: int, values) -> None:
+        for c, value in enumerate(values):
+            if isinstance(value, str):
+                ws.write_string(r, c, value)
+            else:
+                ws.write(r, c, value)
+
+    write_cells(0, [str(c) for c in schedule_xls.columns])
+    cells = schedule_xls.astype(object).where(schedule_xls.notna(), None)
+    for r, row in enumerate(cells.itertuples(index=False, name=None), start=1):
+        write_cells(r, row)
+    wb.close()
     out_buf.seek(0)
 
     preview = schedule_xls.head(20).to_dict(orient="records")